@@ -4,22 +4,70 @@ import logging
 import shutil
 import os
 import time
+import random
+import urllib.parse
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
 import yaml
 import abc
 import json
+try:
+	import orjson
+except ImportError:
+	orjson = None
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from jinja2 import Environment, FileSystemLoader
 
+def _write_if_changed(path, data):
+	try:
+		with open(path, 'rb') as f:
+			if f.read() == data:
+				return
+	except FileNotFoundError:
+		pass
+	with open(path, 'wb') as f:
+		f.write(data)
+
+def _write_text(path, s):
+	_write_if_changed(path, s.encode('utf-8') + b'\n')
+
+def _write_json(path, obj):
+	if orjson is not None:
+		data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+	else:
+		data = json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+	_write_if_changed(path, data)
+
 class GitHubApiCrawler(abc.ABC):
 
 	__CONFIG_FILENAME = 'config.yml'
+	__CACHE_NAME = '.gh_cache'
+	__MAX_RETRIES = 5
+	__SEARCH_WORKERS = 4
+	__LINK_PATTERN = re.compile(r'<([^>]+)>; rel="(\w+)"')
 	_JSON_FEED_FILENAME = 'feed.json'
+	_MAX_CONNECTIONS = 20
 
 	def __init__(self, user_agent='nikolat/GitHubApiCrawler'):
 		self._logger = self.__get_custom_logger()
 		with open(self.__CONFIG_FILENAME, encoding='utf-8') as file:
 			self._config = yaml.safe_load(file)
-		self.__user_agent = user_agent
+		self.__session = requests_cache.CachedSession(self.__CACHE_NAME, backend='sqlite', cache_control=True, expire_after=600, allowable_codes=(200,))
+		self.__session.headers.update({
+			'Accept': 'application/vnd.github+json',
+			'Authorization': f'Bearer {os.getenv("GITHUB_TOKEN")}',
+			'X-GitHub-Api-Version': '2022-11-28',
+			'User-Agent': user_agent
+		})
+		self.__session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=self._MAX_CONNECTIONS, max_retries=0))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.__session.close()
 
 	def __get_custom_logger(self):
 		custom_logger = logging.getLogger('custom_logger')
@@ -34,37 +82,47 @@ class GitHubApiCrawler(abc.ABC):
 		handler.setFormatter(handler_formatter)
 		return custom_logger
 
+	def __get_retry_wait(self, response, attempt):
+		headers = response.headers
+		wait = 2 ** attempt + random.uniform(0, 1)
+		if response.status_code in (403, 429):
+			wait = max(wait, 60)
+		if 'Retry-After' in headers:
+			wait = max(wait, int(headers['Retry-After']))
+		if headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in headers:
+			wait = max(wait, int(headers['X-RateLimit-Reset']) - time.time())
+		return wait
+
 	def _request_with_retry(self, url, payload, retry=True):
 		logger = self._logger
-		headers = {
-			'Accept': 'application/vnd.github+json',
-			'Authorization': f'Bearer {os.getenv("GITHUB_TOKEN")}',
-			'X-GitHub-Api-Version': '2022-11-28',
-			'User-Agent': self.__user_agent
-		}
-		response = requests.get(url, params=payload, headers=headers)
-		try:
-			response.raise_for_status()
-		except requests.RequestException as e:
-			logger.warning(f'Status: {response.status_code}, URL: {url}')
-			logger.debug(e.response.text)
-			if retry:
-				if 'Retry-After' in response.headers:
-					wait = int(response.headers['Retry-After'])
-				else:
-					wait = 180
-				logger.debug(f'Sleeping to retry after {wait} seconds.')
-				time.sleep(wait)
-				response = requests.get(url, params=payload, headers=headers)
-				try:
-					response.raise_for_status()
-				except requests.RequestException as e:
-					logger.warning(f'Status: {response.status_code}, URL: {url}')
-					logger.debug(e.response.text)
+		session = self.__session
+		for attempt in range(self.__MAX_RETRIES + 1):
+			response = session.get(url, params=payload)
+			try:
+				response.raise_for_status()
+			except requests.RequestException as e:
+				logger.warning(f'Status: {response.status_code}, URL: {url}')
+				logger.debug(e.response.text)
+				if not retry:
+					return response
+				status = response.status_code
+				if attempt == self.__MAX_RETRIES or (400 <= status < 500 and status not in (403, 429)):
 					raise
-				else:
+				wait = self.__get_retry_wait(response, attempt)
+				logger.debug(f'Sleeping to retry after {wait:.1f} seconds.')
+				time.sleep(wait)
+			else:
+				if attempt > 0:
 					logger.debug(f'Status: {response.status_code}, URL: {url}')
-		return response
+				return response
+
+	def _get_json(self, response):
+		if orjson is not None:
+			return orjson.loads(response.content)
+		return response.json()
+
+	def __get_links(self, response):
+		return {m.group(2): m.group(1) for m in self.__LINK_PATTERN.finditer(response.headers.get('link', ''))}
 
 	def search(self):
 		config = self._config
@@ -73,13 +131,20 @@ class GitHubApiCrawler(abc.ABC):
 		responses = []
 		response = self._request_with_retry(url, payload)
 		responses.append(response)
-		pattern = re.compile(r'<(.+?)>; rel="(\w+?)"')
-		links = {m.group(2): m.group(1) for m in pattern.finditer(response.headers['link'] if 'link' in response.headers else '')}
-		while 'next' in links:
-			url = links['next']
-			response = self._request_with_retry(url, None)
-			responses.append(response)
-			links = {m.group(2): m.group(1) for m in pattern.finditer(response.headers['link'] if 'link' in response.headers else '')}
+		links = self.__get_links(response)
+		if 'last' in links:
+			last_url = urllib.parse.urlsplit(links['last'])
+			query = urllib.parse.parse_qs(last_url.query)
+			last_page = int(query['page'][0])
+			urls = [last_url._replace(query=urllib.parse.urlencode({**query, 'page': [str(page)]}, doseq=True)).geturl() for page in range(2, last_page + 1)]
+			with ThreadPoolExecutor(max_workers=self.__SEARCH_WORKERS) as executor:
+				responses.extend(executor.map(lambda url: self._request_with_retry(url, None), urls))
+		else:
+			while 'next' in links:
+				url = links['next']
+				response = self._request_with_retry(url, None)
+				responses.append(response)
+				links = self.__get_links(response)
 		self._responses = responses
 		return self
 
@@ -94,58 +159,60 @@ class GitHubApiCrawler(abc.ABC):
 	def _get_feed_dict(self):
 		return {}
 
-	def export(self):
+	@abc.abstractmethod
+	def _get_feed_item(self):
+		return {}
+
+	def __export_group(self, directory, templates, title, base_url, entries, feed_items):
 		config = self._config
-		entries = self._entries
-		categories = self._categories
-		authors = self._authors
-		filename_json = self._JSON_FEED_FILENAME
-		env = Environment(loader=FileSystemLoader('./templates', encoding='utf8'), autoescape=True)
-		# top page
 		data = {
 			'entries': entries,
 			'config': config
 		}
-		for filename in ['index.html', 'rss2.xml']:
-			template = env.get_template(filename)
+		for filename, template in templates.items():
 			rendered = template.render(data)
-			with open(f'docs/{filename}', 'w', encoding='utf-8') as f:
-				f.write(rendered + '\n')
-		with open(f'docs/{filename_json}', 'w', encoding='utf-8') as f:
-			json.dump(self._get_feed_dict(config['site_title'], config['self_url'], config['site_description'], entries), f, ensure_ascii=False, indent=4)
+			_write_text(f'{directory}{filename}', rendered)
+		_write_json(f'{directory}{self._JSON_FEED_FILENAME}', self._get_feed_dict(title, base_url, config['site_description'], feed_items))
+
+	def export(self):
+		config = self._config
+		entries = self._entries
+		categories = self._categories
+		authors = self._authors
+		feed_items = [self._get_feed_item(e) for e in entries]
+		entries_by_category = defaultdict(list)
+		entries_by_author = defaultdict(list)
+		feed_items_by_category = defaultdict(list)
+		feed_items_by_author = defaultdict(list)
+		for e, feed_item in zip(entries, feed_items):
+			entries_by_category[e['category']].append(e)
+			entries_by_author[e['author']].append(e)
+			feed_items_by_category[e['category']].append(feed_item)
+			feed_items_by_author[e['author']].append(feed_item)
+		env = Environment(loader=FileSystemLoader('./templates', encoding='utf8'), autoescape=True, cache_size=-1, auto_reload=False)
+		templates = {filename: env.get_template(filename) for filename in ['index.html', 'rss2.xml']}
+		category_templates = {filename: env.get_template(f'category/{filename}') for filename in ['index.html', 'rss2.xml']}
+		author_templates = {filename: env.get_template(f'author/{filename}') for filename in ['index.html', 'rss2.xml']}
+		# top page
+		self.__export_group('docs/', templates, config['site_title'], config['self_url'], entries, feed_items)
 		# category
 		for category in categories:
-			shutil.rmtree(f'docs/{category}/', ignore_errors=True)
-			os.mkdir(f'docs/{category}/')
-			target_entries = [e for e in entries if e['category'] == category]
-			data = {
-				'entries': target_entries,
-				'config': config
-			}
-			for filename in ['index.html', 'rss2.xml']:
-				template = env.get_template(f'category/{filename}')
-				rendered = template.render(data)
-				with open(f'docs/{category}/{filename}', 'w', encoding='utf-8') as f:
-					f.write(rendered + '\n')
-			with open(f'docs/{category}/{filename_json}', 'w', encoding='utf-8') as f:
-				json.dump(self._get_feed_dict(f'{category} | {config["site_title"]}', f'{config["self_url"]}{category}/', config['site_description'], target_entries), f, ensure_ascii=False, indent=4)
+			os.makedirs(f'docs/{category}/', exist_ok=True)
+		groups = [(f'docs/{category}/', category_templates, f'{category} | {config["site_title"]}', f'{config["self_url"]}{category}/', entries_by_category[category], feed_items_by_category[category]) for category in categories]
 		# author
-		shutil.rmtree('docs/author/', ignore_errors=True)
-		os.mkdir('docs/author/')
+		os.makedirs('docs/author/', exist_ok=True)
+		for entry in os.scandir('docs/author/'):
+			if entry.name in entries_by_author:
+				continue
+			if entry.is_dir(follow_symlinks=False):
+				shutil.rmtree(entry.path)
+			else:
+				os.unlink(entry.path)
 		for author in authors:
-			os.mkdir(f'docs/author/{author}/')
-			target_entries = [e for e in entries if e['author'] == author]
-			data = {
-				'entries': target_entries,
-				'config': config
-			}
-			for filename in ['index.html', 'rss2.xml']:
-				template = env.get_template(f'author/{filename}')
-				rendered = template.render(data)
-				with open(f'docs/author/{author}/{filename}', 'w', encoding='utf-8') as f:
-					f.write(rendered + '\n')
-			with open(f'docs/author/{author}/{filename_json}', 'w', encoding='utf-8') as f:
-				json.dump(self._get_feed_dict(f'{author} | {config["site_title"]}', f'{config["self_url"]}author/{author}/', config['site_description'], target_entries), f, ensure_ascii=False, indent=4)
+			os.makedirs(f'docs/author/{author}/', exist_ok=True)
+		groups += [(f'docs/author/{author}/', author_templates, f'{author} | {config["site_title"]}', f'{config["self_url"]}author/{author}/', entries_by_author[author], feed_items_by_author[author]) for author in authors]
+		with ThreadPoolExecutor() as executor:
+			list(executor.map(lambda group: self.__export_group(*group), groups))
 		# sitemap
 		data = {
 			'categories': categories,
@@ -156,6 +223,5 @@ class GitHubApiCrawler(abc.ABC):
 		filename = 'sitemap.xml'
 		template = env.get_template(filename)
 		rendered = template.render(data)
-		with open(f'docs/{filename}', 'w', encoding='utf-8') as f:
-			f.write(rendered + '\n')
+		_write_text(f'docs/{filename}', rendered)
 		return self
@@ -1,110 +1,112 @@
 import crawler
+import bisect
 import datetime
-import zoneinfo
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+_JST = datetime.timezone(datetime.timedelta(hours=9))
+_DAYS_BOUNDS = (1, 7, 30, 365)
+_DAYS_CLASSNAMES = ('days-over-0', 'days-over-1', 'days-over-7', 'days-over-30', 'days-over-365')
+
+@functools.lru_cache(maxsize=None)
+def _parse_utc_as_jst(s):
+	return datetime.datetime.fromisoformat(s.replace('Z', '+00:00')).astimezone(_JST)
 
 class GitHubDauCrawler(crawler.GitHubApiCrawler):
 
-	__DENIED_CATEGORIES = ['media', 'author']
+	__TOPIC_PREFIX = 'ukagaka-'
+	__DENIED_CATEGORIES = frozenset(('media', 'author'))
 
 	def __init__(self):
 		super().__init__('nikolat/GitHubDauCrawler')
 
 	def crawl(self):
-		jst = zoneinfo.ZoneInfo('Asia/Tokyo')
-		now = datetime.datetime.now(jst)
+		now = datetime.datetime.now(_JST)
 		logger = self._logger
 		config = self._config
 		responses = self._responses
 		entries = []
-		categories = []
-		authors = []
+		targets = []
+		prefix = self.__TOPIC_PREFIX
+		denied_categories = self.__DENIED_CATEGORIES
 		for response in responses:
-			for item in response.json()['items']:
-				types = [t.replace('ukagaka-', '') for t in item['topics'] if 'ukagaka-' in t]
-				if len(types) == 0:
-					logger.debug(f'ukagaka-* topic is not found in {item["full_name"]}')
-					continue
-				types = [t for t in types if t not in self.__DENIED_CATEGORIES]
+			for item in self._get_json(response)['items']:
+				types = [t[len(prefix):] for t in item['topics'] if t.startswith(prefix) and t[len(prefix):] not in denied_categories]
 				if len(types) == 0:
-					logger.debug(f'ukagaka-* topic is not allowed in {item["full_name"]}')
+					if any(t.startswith(prefix) for t in item['topics']):
+						logger.debug(f'ukagaka-* topic is not allowed in {item["full_name"]}')
+					else:
+						logger.debug(f'ukagaka-* topic is not found in {item["full_name"]}')
 					continue
-				category = types[0]
-				if item['full_name'] in config['redirect']:
-					logger.debug(f'redirected form {item["full_name"]} to {config["redirect"][item["full_name"]]}')
-					url = 'https://api.github.com/repos/' + config['redirect'][item['full_name']]
-					r = self._request_with_retry(url, None, logger)
-					r_item = r.json()
-					item['created_at'] = r_item['created_at']
-					item['pushed_at'] = r_item['pushed_at']
-				dt_created = datetime.datetime.strptime(item['created_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc).astimezone(tz=jst)
-				dt_updated = datetime.datetime.strptime(item['pushed_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc).astimezone(tz=jst)
-				diff = now - dt_updated
-				if diff.days < 1:
-					classname = 'days-over-0'
-				elif diff.days < 7:
-					classname = 'days-over-1'
-				elif diff.days < 30:
-					classname = 'days-over-7'
-				elif diff.days < 365:
-					classname = 'days-over-30'
-				else:
-					classname = 'days-over-365'
-				entry = {
-					'id': item['full_name'],
-					'title': item['name'],
-					'category': category,
-					'classname': classname,
-					'author': item['owner']['login'],
-					'author_url': item['owner']['html_url'],
-					'author_avatar': item['owner']['avatar_url'],
-					'content_text': '',
-					'summary': item['description'] if item['description'] is not None else '',
-					'tags': item['topics'],
-					'html_url': item['html_url'],
-					'created_at_time': item['created_at'],
-					'created_at_str': dt_created.strftime('%Y-%m-%d %H:%M:%S'),
-					'updated_at_time': item['pushed_at'],
-					'updated_at_str': dt_updated.strftime('%Y-%m-%d %H:%M:%S'),
-					'updated_at_rss2': dt_updated.strftime('%a, %d %b %Y %H:%M:%S %z')
-				}
-				entries.append(entry)
-				if category not in categories:
-					categories.append(category)
-				if item['owner']['login'] not in authors:
-					authors.append(item['owner']['login'])
+				targets.append((item, types[0]))
+		redirected = [item for item, _ in targets if item['full_name'] in config['redirect']]
+		urls = []
+		for item in redirected:
+			logger.debug(f'redirected form {item["full_name"]} to {config["redirect"][item["full_name"]]}')
+			urls.append('https://api.github.com/repos/' + config['redirect'][item['full_name']])
+		with ThreadPoolExecutor(max_workers=self._MAX_CONNECTIONS) as executor:
+			for item, r in zip(redirected, executor.map(lambda url: self._request_with_retry(url, None), urls)):
+				r_item = self._get_json(r)
+				item['created_at'] = r_item['created_at']
+				item['pushed_at'] = r_item['pushed_at']
+		for item, category in targets:
+			dt_created = _parse_utc_as_jst(item['created_at'])
+			dt_updated = _parse_utc_as_jst(item['pushed_at'])
+			diff = now - dt_updated
+			classname = _DAYS_CLASSNAMES[bisect.bisect_right(_DAYS_BOUNDS, diff.days)]
+			entry = {
+				'id': item['full_name'],
+				'title': item['name'],
+				'category': category,
+				'classname': classname,
+				'author': item['owner']['login'],
+				'author_url': item['owner']['html_url'],
+				'author_avatar': item['owner']['avatar_url'],
+				'content_text': '',
+				'summary': item['description'] if item['description'] is not None else '',
+				'tags': item['topics'],
+				'html_url': item['html_url'],
+				'created_at_time': item['created_at'],
+				'created_at_str': dt_created.replace(tzinfo=None).isoformat(' ', 'seconds'),
+				'updated_at_time': item['pushed_at'],
+				'updated_at_str': dt_updated.replace(tzinfo=None).isoformat(' ', 'seconds'),
+				'updated_at_rss2': dt_updated.strftime('%a, %d %b %Y %H:%M:%S %z')
+			}
+			entries.append(entry)
 		self._entries = entries
-		self._categories = categories
-		self._authors = authors
+		self._categories = list(dict.fromkeys(e['category'] for e in entries))
+		self._authors = list(dict.fromkeys(e['author'] for e in entries))
 		return self
 
-	def _get_feed_dict(self, title, base_url, description, entries):
+	def _get_feed_dict(self, title, base_url, description, items):
 		return {
 			'version': 'https://jsonfeed.org/version/1.1',
 			'title': title,
 			'home_page_url': base_url,
 			'feed_url': f'{base_url}{self._JSON_FEED_FILENAME}',
 			'description': description,
-			'items': [
+			'items': items
+		}
+
+	def _get_feed_item(self, e):
+		return {
+			'id': e['id'],
+			'url': e['html_url'],
+			'title': e['title'],
+			'content_text': e['content_text'],
+			'summary': e['summary'],
+			'date_published': e['created_at_time'],
+			'date_modified': e['updated_at_time'],
+			'authors': [
 				{
-					'id': e['id'],
-					'url': e['html_url'],
-					'title': e['title'],
-					'content_text': e['content_text'],
-					'summary': e['summary'],
-					'date_published': e['created_at_time'],
-					'date_modified': e['updated_at_time'],
-					'authors': [
-						{
-							'name': e['author'],
-							'url': e['author_url'],
-							'avatar': e['author_avatar']
-						}
-					],
-					'tags': e['tags']
+					'name': e['author'],
+					'url': e['author_url'],
+					'avatar': e['author_avatar']
 				}
-			for e in entries]
+			],
+			'tags': e['tags']
 		}
 
 if __name__ == '__main__':
-	g = GitHubDauCrawler()
-	g.search().crawl().export()
+	with GitHubDauCrawler() as g:
+		g.search().crawl().export()